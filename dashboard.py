@@ -1,15 +1,25 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 from hubspot import HubSpot
+from hubspot.crm.deals import PublicObjectSearchRequest
 from hubspot.crm.deals.exceptions import ApiException
 from hubspot.crm.owners.exceptions import ApiException as OwnersApiException
-import pytz
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
 
 # --- 페이지 설정 ---
 st.set_page_config(layout="wide", page_title="GS KR Sales Dashboard")
+# 슬라이스는 쓰기 전까지 원본 데이터를 공유 (pandas 3.0부터는 기본 동작이라 2.x에서만 설정)
+if int(pd.__version__.split('.')[0]) < 3: pd.set_option('mode.copy_on_write', True)
 
 # --- 담당자 리스트 ---
 BDR_NAMES = ['Sohee (Blair) Kim', 'Soorim Yu', 'Gyeol Jang', 'Minyoung Kim', 'Hyewon Han','Minjeong Jang','Chanwoo Bae']
@@ -34,83 +44,242 @@ DEAL_STAGE_MAPPING = {
     '1105439053': 'Cancel'
 }
 
+# 모든 날짜는 한국 시간 기준(naive KST)으로 다룸
+KOREA_TZ = ZoneInfo('Asia/Seoul')
+
 # '계약 성사' 및 '실패' 기준
 won_stages = ['Contract Signed', 'Payment Complete']
 lost_stages = ['Closed Lost', 'Dropped', 'Lost', 'Cancel']
 
+# --- 딜 목록 표 공통 (Next Focus, 장기 체류 딜, 실패/드랍 딜) ---
+TABLE_ROW_LIMIT = 200  # 표에 표시할 최대 행 수 (수천 행을 그대로 브라우저로 보내 렌더링하지 않도록)
+
+def row_limit_caption(total, order_label):
+    # 표가 TABLE_ROW_LIMIT에서 잘린 경우에만 전체 건수를 함께 안내
+    if total > TABLE_ROW_LIMIT: st.caption(f"{order_label} {TABLE_ROW_LIMIT}건만 표시 (전체 {total:,}건)")
+
+# --- HubSpot에서 가져올 Deal 속성 ---
+DEAL_PROPERTIES = [
+    "dealname", "dealstage", "amount", "createdate", "closedate", 
+    "hs_lastmodifieddate", "hubspot_owner_id", "sdr", "hs_lost_reason",
+    "dropped_reason", "remark__free_text_",
+    "expected_closing_date", "hs_v2_date_entered_current_stage",
+    "contract_sent_date", "contract_signed_date", 
+    "payment_complete_date", "demo_booked", "demo_done_date"
+]
+
+# --- 증분 동기화용 로컬 캐시 ---
+CACHE_DIR = Path(__file__).parent / '.cache'
+DEALS_CACHE_PATH = CACHE_DIR / 'hubspot_deals.parquet'
+SYNC_STATE_PATH = CACHE_DIR / 'hubspot_sync.json'
+DEALS_CACHE_TTL = 3600  # 마지막 동기화 후 이 시간(초) 안에는 HubSpot을 호출하지 않고 캐시를 그대로 사용
+FULL_SYNC_INTERVAL = 86400  # 삭제된 딜을 반영하기 위해 하루에 한 번은 전체 동기화 (초)
+SEARCH_RESULT_LIMIT = 10000  # Search API로 페이지네이션 가능한 최대 결과 수
+SEARCH_CALL_INTERVAL = 0.2  # Search API 호출 한도(계정당 초당 5회)를 넘지 않도록 요청 시작 간격 (초)
+DEAL_FETCH_WORKERS = 4  # 전체 동기화 시 Search API 페이지를 동시에 받을 스레드 수 (요청 시작 간격은 SEARCH_CALL_INTERVAL로 제한)
+
+def read_deals_cache():
+    try:
+        sync_state = json.loads(SYNC_STATE_PATH.read_text())
+        # 필요한 컬럼만 읽고, 속성 목록이 바뀌어 컬럼이 없으면 전체 동기화로 다시 구성
+        cached_df = pd.read_parquet(DEALS_CACHE_PATH, columns=['id'] + DEAL_PROPERTIES)
+    except (OSError, ValueError, KeyError):
+        return None, None
+    return cached_df, sync_state
+
+def write_deals_cache(raw_df, sync_state):
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        raw_df.to_parquet(DEALS_CACHE_PATH, index=False, compression='zstd')
+        SYNC_STATE_PATH.write_text(json.dumps(sync_state))
+    except OSError:
+        pass  # 캐시 저장 실패는 다음 로딩 때 전체 동기화로 복구됨
+
+# 행(dict) 단위가 아닌 컬럼 단위로 구성 — 페이지를 받는 즉시 컬럼 리스트에 추가하고, 누락된 속성은 None으로 채움
+def empty_deal_columns():
+    return {'id': [], **{prop: [] for prop in DEAL_PROPERTIES}}
+
+def append_deal_columns(columns, deals):
+    for deal in deals:
+        props = deal.properties
+        columns['id'].append(deal.id)
+        for prop in DEAL_PROPERTIES:
+            columns[prop].append(props.get(prop))
+
+def search_deals(search_api, sort_property, filter_groups=None, after=None):
+    search_request = PublicObjectSearchRequest(
+        filter_groups=filter_groups or [],
+        sorts=[{"propertyName": sort_property, "direction": "ASCENDING"}],
+        properties=DEAL_PROPERTIES, limit=100, after=after
+    )
+    return search_api.do_search(public_object_search_request=search_request)
+
+def fetch_all_deals(hubspot_client):
+    # Search API는 offset 기반이라 전체 건수만 알면 나머지 페이지를 병렬로 요청할 수 있음
+    all_deals = empty_deal_columns()
+    # SDK는 *_api 속성에 접근할 때마다 새 ApiClient(새 커넥션 풀)를 만들므로, 한 번 만든 API 객체를 재사용해 TLS 연결을 유지
+    search_api = hubspot_client.crm.deals.search_api
+    first_page = search_deals(search_api, 'hs_object_id')
+    if first_page.total <= SEARCH_RESULT_LIMIT:
+        append_deal_columns(all_deals, first_page.results)
+        with ThreadPoolExecutor(max_workers=DEAL_FETCH_WORKERS) as executor:
+            futures = []
+            for offset in range(100, first_page.total, 100):
+                time.sleep(SEARCH_CALL_INTERVAL)
+                futures.append(executor.submit(search_deals, search_api, 'hs_object_id', after=str(offset)))
+            for future in futures:
+                append_deal_columns(all_deals, future.result().results)
+        return all_deals
+
+    # 검색 한도를 넘는 경우 cursor 기반 목록 API로 순차 조회
+    basic_api = hubspot_client.crm.deals.basic_api
+    after = None
+    while True:
+        page = basic_api.get_page(limit=100, after=after, properties=DEAL_PROPERTIES)
+        append_deal_columns(all_deals, page.results)
+        if page.paging and page.paging.next: after = page.paging.next.after
+        else: break
+    return all_deals
+
+def fetch_changed_deals(hubspot_client, since_ms):
+    changed_deals = empty_deal_columns()
+    search_api = hubspot_client.crm.deals.search_api
+    after = None
+    while True:
+        filter_groups = [{"filters": [{"propertyName": "hs_lastmodifieddate", "operator": "GTE", "value": str(since_ms)}]}]
+        page = search_deals(search_api, 'hs_lastmodifieddate', filter_groups, after)
+        append_deal_columns(changed_deals, page.results)
+        if not (page.paging and page.paging.next): break
+        after = page.paging.next.after
+        if int(after) >= SEARCH_RESULT_LIMIT:
+            # 검색 한도에 도달하면 마지막으로 받은 수정 시각부터 다시 검색
+            since_ms = pd.Timestamp(changed_deals['hs_lastmodifieddate'][-1]).value // 10**6
+            after = None
+    return changed_deals
+
+def sync_deals(hubspot_client):
+    # 로컬 캐시가 있으면 마지막 동기화 이후 수정된 딜만 Search API로 가져와 병합
+    cached_df, sync_state = read_deals_cache()
+    if cached_df is not None and time.time() - sync_state.get('synced_at', 0) < DEALS_CACHE_TTL:
+        return cached_df
+
+    full_sync = cached_df is None or time.time() - sync_state.get('full_sync_at', 0) > FULL_SYNC_INTERVAL
+    spinner_text = "HubSpot에서 모든 Deal 데이터를 불러오는 중입니다... (시간이 걸릴 수 있습니다)" if full_sync else "HubSpot에서 변경된 Deal 데이터를 불러오는 중입니다..."
+    with st.spinner(spinner_text):
+        if full_sync:
+            # 페이지를 병렬로 받는 동안 수정된 딜은 두 페이지에 걸쳐 중복으로 올 수 있으므로 마지막 값만 유지
+            raw_df = pd.DataFrame(fetch_all_deals(hubspot_client)).drop_duplicates('id', keep='last')
+            sync_state = {'full_sync_at': time.time()}
+        else:
+            # 검색 한도 이후 재검색은 GTE 조건이라 경계의 딜이 중복으로 올 수 있으므로 마지막 값만 유지
+            changed_df = pd.DataFrame(fetch_changed_deals(hubspot_client, sync_state['last_modified_ms'])).drop_duplicates('id', keep='last')
+            if changed_df.empty: raw_df = cached_df
+            else: raw_df = pd.concat([cached_df[~cached_df['id'].isin(changed_df['id'])], changed_df], ignore_index=True)
+
+    last_modified = pd.to_datetime(raw_df['hs_lastmodifieddate'], errors='coerce', utc=True, format='ISO8601').max()
+    sync_state['last_modified_ms'] = last_modified.value // 10**6 if pd.notna(last_modified) else 0
+    sync_state['synced_at'] = time.time()
+    write_deals_cache(raw_df, sync_state)
+    return raw_df
+
+# --- Owner 정보 (작업 스레드에서 호출되므로 Streamlit 캐시를 쓰지 않고, 결과는 fetch_raw_deals 캐시와 함께 유지) ---
+def fetch_owner_map(access_token):
+    hubspot_client = HubSpot(access_token=access_token)
+    owners_api = hubspot_client.crm.owners.owners_api
+    owner_id_to_name = {}
+    after_owner = None
+    while True:
+        # Owners API의 최대 페이지 크기(500)로 요청해 왕복 횟수 최소화
+        page = owners_api.get_page(limit=500, after=after_owner)
+        owner_id_to_name.update((owner.id, f"{owner.first_name or ''} {owner.last_name or ''}".strip()) for owner in page.results)
+        if page.paging and page.paging.next: after_owner = page.paging.next.after
+        else: break
+    return owner_id_to_name
+
+def map_owner_names(owner_ids, owner_id_to_name):
+    # Owner ID도 종류가 적으므로 고유 ID만 이름으로 바꾼 뒤 정수 코드로 재배치 (없는 ID/빈 값은 'Unassigned', 결과는 category)
+    id_cat = pd.Categorical(owner_ids)
+    names = pd.Index(id_cat.categories.map(owner_id_to_name), dtype=object).fillna('Unassigned').append(pd.Index(['Unassigned']))
+    name_categories = names.unique()
+    return pd.Categorical.from_codes(name_categories.get_indexer(names)[id_cat.codes], categories=name_categories)
+
 # --- 데이터 로딩 및 전처리 함수 ---
-@st.cache_data(ttl=3600, show_spinner=False)
+# 네트워크 조회(1시간 캐시)와 전처리(원본이 같으면 재사용)를 나눠, 전처리 로직만 바뀌어도 HubSpot을 다시 호출하지 않음
+# 두 결과 모두 cache_resource로 직렬화 없이 모든 세션이 같은 객체를 공유하므로, 반환된 DataFrame은 수정하지 않음 (파생 프레임은 CoW로 분리됨)
+# 하위 캐시는 DataFrame 전체를 해싱하지 않고 조회 시각(data_version)을 키로 사용 (조회 결과가 바뀌면 값도 바뀜)
 def load_data_from_hubspot():
+    raw_df, owner_id_to_name, data_version = fetch_raw_deals()
+    if raw_df is None: return None, None
+    return transform_deals(raw_df, owner_id_to_name, data_version), data_version
+
+@st.cache_resource(ttl=DEALS_CACHE_TTL, show_spinner=False)
+def fetch_raw_deals():
     try:
         access_token = st.secrets["HUBSPOT_ACCESS_TOKEN"]
-        hubspot_client = HubSpot(access_token=access_token)
+        # 병렬 조회 중 호출 한도(429)에 걸리면 잠시 후 재시도 (재시도 소진 시 429 응답을 그대로 받아 ApiException으로 처리)
+        hubspot_client = HubSpot(access_token=access_token, retry=Retry(total=3, backoff_factor=1, status_forcelist=(429,), raise_on_status=False))
     except KeyError:
         st.error("HubSpot 접근 토큰이 설정되지 않았습니다. Streamlit Cloud의 Secrets 설정을 확인하세요.")
-        return None
+        return None, None, None
     
-    owner_id_to_name = {}
-    with st.spinner("HubSpot에서 Owner 정보를 불러오는 중입니다..."):
+    # Owner 조회는 Deal 동기화와 독립적이므로 별도 스레드에서 동시에 진행
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        owner_future = executor.submit(fetch_owner_map, access_token)
         try:
-            all_owners = []
-            after_owner = None
-            while True:
-                page = hubspot_client.crm.owners.owners_api.get_page(after=after_owner)
-                all_owners.extend(page.results)
-                if page.paging and page.paging.next: after_owner = page.paging.next.after
-                else: break
-            owner_id_to_name = {owner.id: f"{owner.first_name or ''} {owner.last_name or ''}".strip() for owner in all_owners}
+            raw_df = sync_deals(hubspot_client)
+        except (ApiException, MaxRetryError) as e:
+            st.error(f"HubSpot Deals API 호출 중 오류 발생: {e}"); return None, None, None
+        try:
+            owner_id_to_name = owner_future.result()
         except Exception as e:
-            st.error(f"Owner 데이터 로딩 중 오류 발생: {e}"); return None
-
-    properties_to_fetch = [
-        "dealname", "dealstage", "amount", "createdate", "closedate", 
-        "hs_lastmodifieddate", "hubspot_owner_id", "sdr", "hs_lost_reason",
-        "dropped_reason", "remark__free_text_",
-        "expected_closing_date", "hs_v2_date_entered_current_stage",
-        "contract_sent_date", "contract_signed_date", 
-        "payment_complete_date", "demo_booked", "demo_done_date"
-    ]
+            st.error(f"Owner 데이터 로딩 중 오류 발생: {e}"); return None, None, None
+    return raw_df, owner_id_to_name, time.time()
 
-    all_deals = []
-    after = None
-    with st.spinner("HubSpot에서 모든 Deal 데이터를 불러오는 중입니다... (시간이 걸릴 수 있습니다)"):
-        try:
-            while True:
-                page = hubspot_client.crm.deals.basic_api.get_page(limit=100, after=after, properties=properties_to_fetch)
-                all_deals.extend([deal.to_dict() for deal in page.results])
-                if page.paging and page.paging.next: after = page.paging.next.after
-                else: break
-        except ApiException as e:
-            st.error(f"HubSpot Deals API 호출 중 오류 발생: {e}"); return None
-        
-    if not all_deals: return pd.DataFrame()
-    df = pd.DataFrame([deal['properties'] for deal in all_deals])
-    if df.empty: return df
-
-    for col in properties_to_fetch:
-        if col not in df.columns:
-            df[col] = pd.NaT if 'date' in col else None
-              
-    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
-    df['dealstage'] = df['dealstage'].map(DEAL_STAGE_MAPPING).fillna(df['dealstage'])
-    df['Deal owner'] = df['hubspot_owner_id'].map(owner_id_to_name).fillna('Unassigned')
+# 원본 프레임/Owner 맵은 '_' 인자로 해싱에서 제외하고 data_version으로만 구분
+@st.cache_resource(ttl=DEALS_CACHE_TTL, max_entries=2, show_spinner=False)
+def transform_deals(_raw_df, _owner_id_to_name, data_version):
+    if _raw_df.empty: return pd.DataFrame()
+    # 딜 ID는 CSV 내보내기용으로 HubSpot 속성명(hs_object_id)으로 유지
+    df = _raw_df.rename(columns={'id': 'hs_object_id'})
+    df['Deal owner'] = map_owner_names(df['hubspot_owner_id'], _owner_id_to_name)
     
-    if 'sdr' in df.columns:
-        df['BDR'] = df['sdr'].map(owner_id_to_name).fillna('Unassigned')
+    if df['sdr'].notna().any():
+        df['BDR'] = map_owner_names(df['sdr'], _owner_id_to_name)
     else:
         st.warning("주의: 'sdr' 속성을 HubSpot에서 찾을 수 없습니다. BDR 리더보드가 비어있을 수 있습니다.")
         df['BDR'] = 'Unassigned'
+
+    # 담당자 필터를 먼저 적용해 이후 변환은 대시보드 대상 딜에만 수행 (Owner ID 원본 컬럼은 CSV 내보내기를 위해 유지)
+    df = df[(df['Deal owner'].isin(AE_NAMES)) | (df['BDR'].isin(BDR_NAMES))]
+
+    # HubSpot 금액은 보통 숫자 문자열이므로 numpy 캐스팅으로 바로 변환, 빈 문자열 등이 섞인 경우에만 to_numeric으로 보정
+    try:
+        amount = np.asarray(df['amount'].to_numpy(dtype=object), dtype='float64')
+        amount[np.isnan(amount)] = 0.0
+    except (TypeError, ValueError):
+        amount = pd.to_numeric(df['amount'], errors='coerce').to_numpy(dtype='float64', na_value=0.0)
+    df['amount'] = amount
+    # 단계 ID는 종류가 적으므로 고유값(카테고리)만 라벨로 매핑한 뒤 정수 코드로 재배치 (같은 라벨의 ID는 하나로 합침, 미매핑 ID는 그대로)
+    stage_raw = pd.Categorical(df['dealstage'])
+    stage_labels = pd.Index([DEAL_STAGE_MAPPING.get(stage, stage) for stage in stage_raw.categories])
+    label_categories = stage_labels.unique()
+    label_codes = np.append(label_categories.get_indexer(stage_labels), -1)  # 마지막 칸: NaN 코드 -1 유지
+    df['dealstage'] = pd.Categorical.from_codes(label_codes[stage_raw.codes], categories=label_categories)
     
     date_cols = [
         'closedate', 'createdate', 'hs_lastmodifieddate', 'expected_closing_date',
         'hs_v2_date_entered_current_stage', 'contract_sent_date', 'contract_signed_date',
         'payment_complete_date', 'demo_booked', 'demo_done_date'
     ]
-    for col in date_cols:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce', utc=True)
-            if df[col].notna().any():
-                df[col] = df[col].dt.tz_convert('Asia/Seoul')
+    # HubSpot은 ISO-8601 문자열을 반환하므로 포맷 추론 없이, 모든 날짜 컬럼을 이어 붙여 한 번에 파싱
+    # KST 벽시계 시각을 tz-naive datetime64로 저장 (이후 비교는 모두 naive KST 기준)
+    parsed_dates = pd.to_datetime(df[date_cols].to_numpy().ravel(order='F'), errors='coerce', utc=True, format='ISO8601')
+    parsed_dates = parsed_dates.tz_convert(KOREA_TZ).tz_localize(None)
+    # pandas 3는 us 단위로 파싱하므로 ns 범위(1677~2262년)를 벗어난 값(예: 9999-12-31)은 NaT로 바꾸고 ns 단위로 저장 (to_ns 오버플로 방지)
+    parsed_dates = parsed_dates.where((parsed_dates >= pd.Timestamp.min) & (parsed_dates <= pd.Timestamp.max)).as_unit('ns')
+    parsed_dates = parsed_dates.to_numpy().reshape(len(date_cols), len(df))
+    for col, values in zip(date_cols, parsed_dates):
+        df[col] = values
 
     rename_map = {
         'dealname': 'Deal name', 'dealstage': 'Deal Stage', 'amount': 'Amount',
@@ -129,19 +298,116 @@ def load_data_from_hubspot():
     }
     df.rename(columns=rename_map, inplace=True)
     
-    if 'Expected Closing Date' in df.columns and 'Close Date' in df.columns:
-        df['Effective Close Date'] = df['Expected Closing Date'].fillna(df['Close Date'])
-    elif 'Close Date' in df.columns: df['Effective Close Date'] = df['Close Date']
-    else: df['Effective Close Date'] = pd.NaT
-    
-    df = df[(df['Deal owner'].isin(AE_NAMES)) | (df['BDR'].isin(BDR_NAMES))].copy()
+    df['Effective Close Date'] = df['Expected Closing Date'].fillna(df['Close Date'])
+
+    # 반복 필터/집계에 쓰이는 저카디널리티 컬럼은 category로 저장 (isin/groupby가 정수 코드로 동작, Deal Stage/담당자는 매핑 시 이미 category)
+    df['BDR'] = df['BDR'].astype('category')
+    # 자유 입력 텍스트 컬럼은 Python 객체 대신 pyarrow 문자열(연속 버퍼)로 보관해 캐시 직렬화/메모리 비용 절감
+    text_cols = ['Deal name', 'Failure Reason', 'Dropped Reason', 'Dropped Reason (Remark)']
+    df[text_cols] = df[text_cols].astype('string[pyarrow]')
+
+    # 계약 성사/실패/진행 중 여부는 로딩 시 한 번만 계산해 모든 탭에서 재사용
+    # 카테고리별 판정표(끝에 NaN 코드 -1용 False 추가)를 정수 코드로 인덱싱해 행 단위 문자열 비교 없이 마스크 생성
+    stage_categories = df['Deal Stage'].cat.categories
+    stage_codes = df['Deal Stage'].cat.codes.to_numpy()
+    is_won = np.append(stage_categories.isin(won_stages), False)[stage_codes]
+    is_lost = np.append(stage_categories.isin(lost_stages), False)[stage_codes]
+    df['_is_won'], df['_is_lost'], df['_is_open'] = is_won, is_lost, ~(is_won | is_lost)
     return df
 
+# --- 날짜 연산 헬퍼 ---
+NS_PER_DAY = 86_400_000_000_000
+NAT_NS = np.iinfo(np.int64).min  # to_ns 결과에서 NaT를 나타내는 값
+
+def to_ns(values):
+    # 해상도(us/ns)와 무관하게 int64 나노초로 변환 (NaT는 int64 최솟값), Timestamp는 스칼라로 반환
+    if isinstance(values, pd.Timestamp): return values.value
+    return values.to_numpy(dtype='datetime64[ns]').view('i8')
+
+def days_between(end, start):
+    # end - start 경과 일수 (.dt.days와 같이 내림), NaT가 없는 입력에만 사용
+    return (to_ns(end) - to_ns(start)) // NS_PER_DAY
+
+def avg_transition_days(stage_ns):
+    # (딜 수, 단계 수) int64 행렬을 한 번에 처리: 인접 단계 간 경과 일수의 평균 (NaT/음수 구간 제외, 없으면 NaN)
+    valid = (stage_ns[:, :-1] != NAT_NS) & (stage_ns[:, 1:] != NAT_NS)
+    days = np.diff(stage_ns, axis=1) // NS_PER_DAY  # NaT가 낀 칸은 valid에서 걸러짐
+    valid &= days >= 0
+    counts = valid.sum(axis=0)
+    sums = np.where(valid, days, 0).sum(axis=0)
+    return np.divide(sums, counts, out=np.full(counts.shape, np.nan), where=counts > 0)
+
+# --- 날짜 필터 기준 컬럼의 최소/최대 (한 번의 agg로 계산, 모두 NaT면 (NaT, NaT)) ---
+@st.cache_data(ttl=DEALS_CACHE_TTL, max_entries=8, show_spinner=False)
+def date_bounds(_df, data_version, filter_col):
+    min_ts, max_ts = _df[filter_col].agg(['min', 'max'])
+    return min_ts, max_ts
+
+# --- 기간 필터 결과 (필터 조건이 같으면 슬라이더/선택 박스 조작 시 재계산하지 않음) ---
+# 탭 1~3에서 사용하는 컬럼만 복사 (실패/드랍 사유 컬럼은 tab4에서 df로 직접 조회)
+BASE_COLS = [
+    'Deal name', 'Deal Stage', 'Amount', 'Deal owner', 'BDR', 'Create Date', 'Effective Close Date',
+    'Meeting Booked Date', 'Meeting Done Date', 'Contract Sent Date', 'Contract Signed Date',
+    'Payment Complete Date', 'Date Entered Stage', 'Last Modified Date', '_is_won', '_is_lost', '_is_open'
+]
+
+# df는 '_' 인자로 해싱에서 제외하고 data_version으로 구분 (전체 프레임 해싱이 필터 계산보다 느림)
+@st.cache_data(ttl=DEALS_CACHE_TTL, max_entries=8, show_spinner=False)
+def sort_by_filter_col(_df, data_version, filter_col):
+    # 날짜가 있는 딜만 필터 기준 컬럼 순으로 정렬해 두면 기간 선택은 이진 탐색 + 슬라이스로 끝남 (NaT는 어떤 기간에도 속하지 않음)
+    return _df.loc[_df[filter_col].notna(), BASE_COLS].sort_values(filter_col, kind='stable')
+
+@st.cache_data(ttl=DEALS_CACHE_TTL, max_entries=32, show_spinner=False)
+def filter_deals(_df, data_version, filter_col, start_date, end_date):
+    sorted_df = sort_by_filter_col(_df, data_version, filter_col)
+    filter_ns = to_ns(sorted_df[filter_col])
+    base_df = sorted_df.iloc[np.searchsorted(filter_ns, start_date.value, side='left'):np.searchsorted(filter_ns, end_date.value, side='right')]
+
+    won_deals_df = _df.loc[_df['_is_won'], BASE_COLS]
+    # NaT는 int64 최솟값이므로 범위 비교에서 자연히 제외됨
+    signed_ns = to_ns(won_deals_df['Contract Signed Date'])
+    paid_ns = to_ns(won_deals_df['Payment Complete Date'])
+    won_in_period = ((signed_ns >= start_date.value) & (signed_ns <= end_date.value)) | ((paid_ns >= start_date.value) & (paid_ns <= end_date.value))
+    return base_df, won_deals_df[won_in_period]
+
+# --- 마감일 순 진행 중 딜 (Next Focus 기간 선택을 정렬된 배열의 이진 탐색으로 처리) ---
+@st.cache_data(ttl=DEALS_CACHE_TTL, max_entries=4, show_spinner=False)
+def open_deals_by_close_date(_df, data_version):
+    # 마감일이 없는 딜은 어떤 기간에도 속하지 않으므로 제외 (NaT가 섞이면 정렬 순서가 깨짐)
+    open_deals = _df.loc[_df['_is_open'] & _df['Effective Close Date'].notna(), ['Deal name', 'Deal owner', 'Amount', 'Effective Close Date']]
+    return open_deals.sort_values('Effective Close Date', kind='stable')
+
+# --- 실패/드랍 딜 (기간 필터와 무관하므로 df당 한 번만 선택, 표에는 최근 수정된 상위 행만 표시) ---
+LOST_DISPLAY_COLS = ['Deal name', 'Deal owner', 'Amount', 'Deal Stage', 'Last Modified Date', 'Failure Reason', 'Dropped Reason', 'Dropped Reason (Remark)']
+
+@st.cache_data(ttl=DEALS_CACHE_TTL, max_entries=4, show_spinner=False)
+def lost_deals_by_modified(_df, data_version):
+    lost_deals = _df.loc[_df['_is_lost'], LOST_DISPLAY_COLS]
+    return lost_deals.nlargest(TABLE_ROW_LIMIT, 'Last Modified Date'), len(lost_deals)
+
+# --- CSV 다운로드 데이터 (data_version이 바뀔 때만 다시 직렬화) ---
+@st.cache_data(ttl=DEALS_CACHE_TTL, max_entries=4, show_spinner=False)
+def to_csv_bytes(_df, data_version):
+    export_cols = [col for col in _df.columns if not col.startswith('_')]
+    return _df[export_cols].to_csv(index=False).encode('utf-8-sig')
+
+# --- 차트 생성 함수 (입력 튜플 기준으로 캐싱, Figure 객체 대신 dict로 저장해 캐시 적중 시 역직렬화 비용 절감) ---
+@st.cache_data(ttl=DEALS_CACHE_TTL, max_entries=32, show_spinner=False)
+def make_funnel(stages, counts):
+    return go.Figure(go.Funnel(y=list(stages), x=list(counts), textposition="inside", textinfo="value+percent initial")).to_dict()
+
+@st.cache_data(ttl=DEALS_CACHE_TTL, max_entries=32, show_spinner=False)
+def make_transition_bar(labels, days):
+    time_df = pd.DataFrame({'Transition': list(labels), 'Avg Days': list(days)})
+    fig_time = px.bar(time_df, x='Avg Days', y='Transition', orientation='h', text='Avg Days')
+    fig_time.update_traces(texttemplate='%{text:.1f}일', textposition='auto')
+    return fig_time.to_dict()
+
 # --- UI 및 대시보드 시작 ---
 st.title("🎯 Sales Dashboard")
 st.markdown("데이터를 기반으로 **성장 전략**을 수립합니다.")
 
-df = load_data_from_hubspot()
+df, data_version = load_data_from_hubspot()
 
 if df is None or df.empty:
     st.warning("분석할 데이터가 없거나 로딩에 실패했습니다."); st.stop()
@@ -150,12 +416,12 @@ if df is None or df.empty:
 with st.sidebar:
     st.header("⚙️ 설정")
     st.success("데이터 로딩 완료!")
-    csv_data = df.to_csv(index=False, encoding='utf-8-sig')
+    # CSV는 버튼을 눌렀을 때만 생성하고, 다운로드 후 앱을 다시 실행하지 않음
     st.download_button(
         label="📥 HubSpot DEAL LIST",
-        data=csv_data,
+        data=lambda: to_csv_bytes(df, data_version),
         file_name=f"hubspot_deals_{datetime.now().strftime('%Y%m%d')}.csv",
-        mime="text/csv"
+        mime="text/csv", on_click="ignore"
     )
     
     sales_quota = st.number_input("분기/월별 Sales Quota (목표 매출, USD) 입력", min_value=0, value=500000, step=10000)
@@ -169,230 +435,216 @@ with st.sidebar:
     elif filter_type == '예상/확정 마감일 기준': filter_col = 'Effective Close Date'
     else: filter_col = 'Last Modified Date'
     
-    if not df[filter_col].isna().all():
-        min_date, max_date = df[filter_col].min().date(), df[filter_col].max().date()
+    min_ts, max_ts = date_bounds(df, data_version, filter_col)
+    if pd.notna(min_ts):
+        min_date, max_date = min_ts.date(), max_ts.date()
         date_range = st.date_input("분석할 날짜 범위 선택", value=(min_date, max_date), min_value=min_date, max_value=max_date)
     else:
         st.error(f"'{filter_col}' 데이터가 없어 필터를 설정할 수 없습니다."); st.stop()
 
 # --- 데이터 필터링 ---
-korea_tz = pytz.timezone('Asia/Seoul')
-start_date = korea_tz.localize(datetime.combine(date_range[0], datetime.min.time()))
-end_date = korea_tz.localize(datetime.combine(date_range[1], datetime.max.time()))
+# 기간 경계와 '오늘'은 재실행마다 한 번만 계산해 모든 탭에서 재사용 (모두 naive KST)
+# 경계가 ns 범위(pd.Timestamp.min~max)와 같은 날이면 하루를 더할 때 오버플로하므로 범위 끝으로 고정
+start_date = max(pd.Timestamp(date_range[0]), pd.Timestamp.min)
+end_date = pd.Timestamp.max if date_range[1] >= pd.Timestamp.max.date() else pd.Timestamp(date_range[1]) + pd.Timedelta(days=1) - pd.Timedelta(nanoseconds=1)
+today = pd.Timestamp.now(tz=KOREA_TZ).tz_localize(None)
+
+base_df, deals_won_in_period = filter_deals(df, data_version, filter_col, start_date, end_date)
+
+# --- 위젯 하나에만 의존하는 패널 (fragment: 해당 위젯을 조작하면 이 패널만 다시 실행) ---
+@st.fragment
+def focus_deals_panel(df, data_version, today):
+    focus_days = st.selectbox("집중할 기간(일)을 선택하세요:", (30, 60, 90), index=0)
+    days_later = today + timedelta(days=focus_days)
+    # 마감일 순으로 정렬된 진행 중 딜에서 기간 경계를 이진 탐색으로 찾고, 표에는 상위 행만 보여주므로 부분 선택(nlargest)
+    open_by_close = open_deals_by_close_date(df, data_version)
+    close_ns = to_ns(open_by_close['Effective Close Date'])
+    focus_start, focus_end = np.searchsorted(close_ns, to_ns(today), side='left'), np.searchsorted(close_ns, to_ns(days_later), side='right')
+    focus_deals = open_by_close.iloc[focus_start:focus_end].nlargest(TABLE_ROW_LIMIT, 'Amount')
+    if not focus_deals.empty:
+        row_limit_caption(focus_end - focus_start, "금액 상위")
+        focus_deals = focus_deals.assign(**{'Days to Close': days_between(focus_deals['Effective Close Date'], today)})
+        st.dataframe(focus_deals.style.format({'Amount': '${:,.0f}'}), use_container_width=True)
+    else:
+        st.info(f"향후 {focus_days}일 내에 마감될 것으로 예상되는 딜이 없습니다.")
 
-base_df = df[df[filter_col].between(start_date, end_date)].copy()
+@st.fragment
+def stale_deals_panel(open_deals_base, today):
+    stale_threshold = st.slider("며칠 이상 같은 단계에 머물면 '장기 체류'로 볼까요?", 7, 90, 30)
 
-won_deals_df = df[df['Deal Stage'].isin(won_stages)].copy()
-signed_in_period = won_deals_df['Contract Signed Date'].between(start_date, end_date)
-paid_in_period = won_deals_df['Payment Complete Date'].between(start_date, end_date)
-deals_won_in_period = won_deals_df[signed_in_period.fillna(False) | paid_in_period.fillna(False)]
+    # 경과 일수와 마스크를 int64 배열로 한 번에 계산하고, 남은 행만 골라 'Days in Stage'를 붙임 (NaT 행의 값은 마스크에서 제외)
+    entered_ns = to_ns(open_deals_base['Date Entered Stage'])
+    days_in_stage = (to_ns(today) - entered_ns) // NS_PER_DAY
+    stale_mask = (entered_ns != NAT_NS) & (days_in_stage > stale_threshold)
+    stale_deals_df = open_deals_base.iloc[np.flatnonzero(stale_mask)].assign(**{'Days in Stage': days_in_stage[stale_mask]})
+    if not stale_deals_df.empty:
+        st.warning(f"{stale_threshold}일 이상 같은 단계에 머물러 있는 '주의'가 필요한 딜 목록입니다.")
+        row_limit_caption(len(stale_deals_df), "체류 기간 상위")
+        st.dataframe(stale_deals_df[['Deal name', 'Deal owner', 'Deal Stage', 'Amount', 'Days in Stage']].nlargest(TABLE_ROW_LIMIT, 'Days in Stage').style.format({'Amount': '${:,.0f}', 'Days in Stage': '{:.0f}일'}), use_container_width=True)
+    else:
+        st.success("선택된 조건에 해당하는 장기 체류 딜이 없습니다. 👍")
 
 # --- 메인 대시보드 ---
-tab1, tab2, tab3, tab4 = st.tabs(["🚀 통합 대시보드", "🧑‍💻 담당자별 상세 분석", "⚠️ 기회 & 리스크 관리", "📉 실패/드랍 분석"])
+# 선택된 탭의 내용만 실행 (탭 전환 시 재실행되며, 보이지 않는 탭의 집계/표 생성은 건너뜀)
+tab1, tab2, tab3, tab4 = st.tabs(["🚀 통합 대시보드", "🧑‍💻 담당자별 상세 분석", "⚠️ 기회 & 리스크 관리", "📉 실패/드랍 분석"], key="active_tab", on_change="rerun")
 
 with tab1:
-    st.header("팀 전체 현황 요약")
+    if tab1.open:
+        st.header("팀 전체 현황 요약")
     
-    won_deals_total = deals_won_in_period
+        won_deals_total = deals_won_in_period
     
-    total_revenue, num_won_deals = won_deals_total['Amount'].sum(), len(won_deals_total)
-    avg_deal_value = total_revenue / num_won_deals if num_won_deals > 0 else 0
+        total_revenue, num_won_deals = won_deals_total['Amount'].sum(), len(won_deals_total)
+        avg_deal_value = total_revenue / num_won_deals if num_won_deals > 0 else 0
     
-    if not won_deals_total.empty and won_deals_total['Contract Signed Date'].notna().all() and won_deals_total['Create Date'].notna().all():
-        avg_sales_cycle = (won_deals_total['Contract Signed Date'] - won_deals_total['Create Date']).dt.days.mean()
-    else:
-        avg_sales_cycle = 0
+        # 두 날짜 컬럼을 int64로 한 번만 변환해 NaT 검사와 경과 일수 계산에 함께 사용 (날짜가 빠진 딜이 있으면 0)
+        signed_ns, created_ns = to_ns(won_deals_total['Contract Signed Date']), to_ns(won_deals_total['Create Date'])
+        if signed_ns.size and not np.any((signed_ns == NAT_NS) | (created_ns == NAT_NS)):
+            avg_sales_cycle = ((signed_ns - created_ns) // NS_PER_DAY).mean()
+        else:
+            avg_sales_cycle = 0
 
-    col1, col2, col3, col4 = st.columns(4)
-    col1.metric("총 계약 금액 (USD)", f"${total_revenue:,.0f}")
-    col2.metric("계약 성사 건수", f"{num_won_deals:,} 건")
-    col3.metric("평균 계약 금액 (USD)", f"${avg_deal_value:,.0f}")
-    col4.metric("평균 영업 사이클", f"{avg_sales_cycle:.1f} 일")
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("총 계약 금액 (USD)", f"${total_revenue:,.0f}")
+        col2.metric("계약 성사 건수", f"{num_won_deals:,} 건")
+        col3.metric("평균 계약 금액 (USD)", f"${avg_deal_value:,.0f}")
+        col4.metric("평균 영업 사이클", f"{avg_sales_cycle:.1f} 일")
 
-    st.markdown("---")
-    st.subheader("파이프라인 효율성 분석")
+        st.markdown("---")
+        st.subheader("파이프라인 효율성 분석")
     
-    col1, col2 = st.columns(2)
-    with col1:
-        st.markdown("**단계별 전환율 (Funnel)**")
-        funnel_stages_map = {
-            'Initial Contact': 'Create Date', 
-            'Meeting Booked': "Meeting Booked Date",
-            'Meeting Done': "Meeting Done Date",
-            'Contract Sent': "Contract Sent Date",
-            'Contract Signed': "Contract Signed Date"
-        }
-        funnel_data = []
-        funnel_data.append({'Stage': 'Initial Contact', 'Count': base_df['Create Date'].notna().sum()})
-        for stage, date_col in funnel_stages_map.items():
-            if stage != 'Initial Contact' and base_df.get(date_col) is not None:
-                count = base_df[date_col].notna().sum()
-                funnel_data.append({'Stage': stage, 'Count': count})
-
-        if len(funnel_data) > 1:
-            funnel_df = pd.DataFrame(funnel_data)
-            fig_funnel = go.Figure(go.Funnel(y=funnel_df['Stage'], x=funnel_df['Count'], textposition="inside", textinfo="value+percent initial"))
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("**단계별 전환율 (Funnel)**")
+            funnel_stages_map = {
+                'Initial Contact': 'Create Date', 
+                'Meeting Booked': "Meeting Booked Date",
+                'Meeting Done': "Meeting Done Date",
+                'Contract Sent': "Contract Sent Date",
+                'Contract Signed': "Contract Signed Date"
+            }
+            funnel_counts = base_df[list(funnel_stages_map.values())].count()
+            fig_funnel = make_funnel(tuple(funnel_stages_map), tuple(int(count) for count in funnel_counts))
             st.plotly_chart(fig_funnel, use_container_width=True)
-        else:
-            st.warning("Funnel 차트를 그리기에 데이터(날짜 컬럼)가 부족합니다.")
-
-    with col2:
-        st.markdown("**단계별 평균 소요 시간 (일)**")
-        stage_transitions = [
-            {'label': 'Create → Meeting Booked', 'start': 'Create Date', 'end': 'Meeting Booked Date'},
-            {'label': 'Booked → Done', 'start': 'Meeting Booked Date', 'end': 'Meeting Done Date'},
-            {'label': 'Done → Contract Sent', 'start': 'Meeting Done Date', 'end': 'Contract Sent Date'},
-            {'label': 'Sent → Signed', 'start': 'Contract Sent Date', 'end': 'Contract Signed Date'}
-        ]
-        avg_times = []
-        for trans in stage_transitions:
-            start_col, end_col = trans['start'], trans['end']
-            if base_df.get(start_col) is not None and base_df.get(end_col) is not None:
-                valid_deals = base_df.dropna(subset=[start_col, end_col])
-                if not valid_deals.empty:
-                    time_diff = (valid_deals[end_col] - valid_deals[start_col]).dt.days
-                    avg_days = time_diff[time_diff >= 0].mean()
-                    if pd.notna(avg_days): avg_times.append({'Transition': trans['label'], 'Avg Days': avg_days})
-        if avg_times:
-            time_df = pd.DataFrame(avg_times)
-            fig_time = px.bar(time_df, x='Avg Days', y='Transition', orientation='h', text='Avg Days')
-            fig_time.update_traces(texttemplate='%{text:.1f}일', textposition='auto')
-            st.plotly_chart(fig_time, use_container_width=True)
-        else:
-            st.warning("단계별 소요 시간을 계산할 데이터(날짜 컬럼)가 부족합니다.")
+
+        with col2:
+            st.markdown("**단계별 평균 소요 시간 (일)**")
+            # 연속된 단계 날짜 컬럼 → 인접 단계 간 전환 라벨
+            transition_stage_cols = ['Create Date', 'Meeting Booked Date', 'Meeting Done Date', 'Contract Sent Date', 'Contract Signed Date']
+            transition_labels = ['Create → Meeting Booked', 'Booked → Done', 'Done → Contract Sent', 'Sent → Signed']
+            stage_ns = np.column_stack([to_ns(base_df[col]) for col in transition_stage_cols])
+            avg_times = [{'Transition': label, 'Avg Days': avg_days} for label, avg_days in zip(transition_labels, avg_transition_days(stage_ns)) if pd.notna(avg_days)]
+            if avg_times:
+                fig_time = make_transition_bar(tuple(t['Transition'] for t in avg_times), tuple(float(t['Avg Days']) for t in avg_times))
+                st.plotly_chart(fig_time, use_container_width=True)
+            else:
+                st.warning("단계별 소요 시간을 계산할 데이터(날짜 컬럼)가 부족합니다.")
 
 with tab2:
-    selected_pic = st.selectbox("분석할 담당자를 선택하세요.", ALL_PICS)
-    st.header(f"'{selected_pic}' 상세 분석")
-
-    if selected_pic == 'All':
-        st.subheader("AE Leaderboard")
-        ae_base_df = base_df[base_df['Deal owner'].isin(AE_NAMES)]
-        if not ae_base_df.empty:
-            ae_won_stats = deals_won_in_period[deals_won_in_period['Deal owner'].isin(AE_NAMES)]\
-                .groupby('Deal owner')\
-                .agg(
-                    Deals_Won=('Deal name', 'count'),
-                    Total_Revenue=('Amount', 'sum')
-                ).reset_index()
-            all_ae_df = pd.DataFrame(AE_NAMES, columns=['Deal owner'])
-            ae_stats = pd.merge(all_ae_df, ae_won_stats, on='Deal owner', how='left').fillna(0)
-            ae_stats = ae_stats.sort_values(by='Total_Revenue', ascending=False)
-            st.dataframe(ae_stats.style.format({'Total_Revenue': '${:,.0f}','Deals_Won': '{:,}'}), use_container_width=True, hide_index=True)
-
-        st.subheader("BDR Leaderboard")
-        bdr_deals_mask = base_df['BDR'].isin(BDR_NAMES) | base_df['Deal owner'].isin(BDR_NAMES)
-        all_bdr_deals = base_df[bdr_deals_mask]
-        if not all_bdr_deals.empty:
-            bdr_performance = []
-            for name in BDR_NAMES:
-                person_deals = all_bdr_deals[(all_bdr_deals['BDR'] == name) | (all_bdr_deals['Deal owner'] == name)]
-                if not person_deals.empty:
-                    initial_contacts = person_deals[person_deals['Deal Stage'] == 'Initial Contact'].shape[0]
-                    meetings_booked = person_deals[person_deals['Deal Stage'] == 'Meeting Booked'].shape[0]
-                    conversion_rate = meetings_booked / initial_contacts if initial_contacts > 0 else 0.0
-                    bdr_performance.append({
-                        'BDR': name, 'Initial Contacts': initial_contacts,
-                        'Meetings Booked (KPI)': meetings_booked, 'Conversion Rate': conversion_rate
-                    })
-            if bdr_performance:
-                bdr_stats = pd.DataFrame(bdr_performance).sort_values(by='Meetings Booked (KPI)', ascending=False)
-                st.dataframe(bdr_stats.style.format({'Conversion Rate': '{:.2%}', 'Initial Contacts': '{:,}', 'Meetings Booked (KPI)': '{:,}'}), use_container_width=True, hide_index=True)
+    if tab2.open:
+        selected_pic = st.selectbox("분석할 담당자를 선택하세요.", ALL_PICS)
+        st.header(f"'{selected_pic}' 상세 분석")
+
+        if selected_pic == 'All':
+            st.subheader("AE Leaderboard")
+            ae_base_df = base_df[base_df['Deal owner'].isin(AE_NAMES)]
+            if not ae_base_df.empty:
+                ae_won_stats = deals_won_in_period.groupby('Deal owner', sort=False, observed=True)\
+                    .agg(
+                        Deals_Won=('Deal name', 'count'),
+                        Total_Revenue=('Amount', 'sum')
+                    )
+                # AE만 남기고 성사 딜이 없는 AE도 0으로 표시 (merge 대신 인덱스 재정렬)
+                ae_stats = ae_won_stats.reindex(AE_NAMES, fill_value=0).reset_index()
+                ae_stats = ae_stats.sort_values(by='Total_Revenue', ascending=False)
+                st.dataframe(ae_stats.style.format({'Total_Revenue': '${:,.0f}','Deals_Won': '{:,}'}), use_container_width=True, hide_index=True)
+
+            st.subheader("BDR Leaderboard")
+            bdr_deals_mask = base_df['BDR'].isin(BDR_NAMES) | base_df['Deal owner'].isin(BDR_NAMES)
+            all_bdr_deals = base_df[bdr_deals_mask]
+            if not all_bdr_deals.empty:
+                # 딜을 BDR에 한 번, (BDR과 다른 경우) Deal owner에 한 번 귀속시킨 뒤 담당자별로 한 번에 집계
+                bdr_col = all_bdr_deals['BDR'].to_numpy(dtype=object)
+                owner_col = all_bdr_deals['Deal owner'].to_numpy(dtype=object)
+                stage_col = all_bdr_deals['Deal Stage'].to_numpy(dtype=object)
+                owner_differs = owner_col != bdr_col
+                person = np.concatenate([bdr_col, owner_col[owner_differs]])
+                person_stage = np.concatenate([stage_col, stage_col[owner_differs]])
+                bdr_stats = pd.DataFrame({
+                    'BDR': person, 'Initial Contacts': person_stage == 'Initial Contact', 'Meetings Booked (KPI)': person_stage == 'Meeting Booked'
+                }).groupby('BDR', sort=False).sum().reindex(BDR_NAMES).dropna().astype(int)
+                if not bdr_stats.empty:
+                    bdr_stats['Conversion Rate'] = (bdr_stats['Meetings Booked (KPI)'] / bdr_stats['Initial Contacts'].where(bdr_stats['Initial Contacts'] > 0)).fillna(0.0)
+                    bdr_stats = bdr_stats.reset_index().sort_values(by='Meetings Booked (KPI)', ascending=False)
+                    st.dataframe(bdr_stats.style.format({'Conversion Rate': '{:.2%}', 'Initial Contacts': '{:,}', 'Meetings Booked (KPI)': '{:,}'}), use_container_width=True, hide_index=True)
     
-    else:
-        # 개인별 상세 분석 기능
-        if selected_pic in BDR_NAMES:
-            filtered_df = base_df[(base_df['BDR'] == selected_pic) | (base_df['Deal owner'] == selected_pic)]
-        else: # AE
-            filtered_df = base_df[base_df['Deal owner'] == selected_pic]
-        
-        if filtered_df.empty:
-            st.warning("선택된 담당자의 데이터가 없습니다.")
         else:
-            won_deals_pic = deals_won_in_period[(deals_won_in_period['Deal owner'] == selected_pic) | (deals_won_in_period['BDR'] == selected_pic)]
-            open_deals_pic = filtered_df[~filtered_df['Deal Stage'].isin(won_stages + lost_stages)]
+            # 개인별 상세 분석 기능
+            if selected_pic in BDR_NAMES:
+                filtered_df = base_df[(base_df['BDR'] == selected_pic) | (base_df['Deal owner'] == selected_pic)]
+            else: # AE
+                filtered_df = base_df[base_df['Deal owner'] == selected_pic]
+        
+            if filtered_df.empty:
+                st.warning("선택된 담당자의 데이터가 없습니다.")
+            else:
+                won_deals_pic = deals_won_in_period[(deals_won_in_period['Deal owner'] == selected_pic) | (deals_won_in_period['BDR'] == selected_pic)]
+                open_deals_pic = filtered_df[filtered_df['_is_open']]
             
-            st.subheader(f"{selected_pic} 성과 요약")
+                st.subheader(f"{selected_pic} 성과 요약")
             
-            if selected_pic in AE_NAMES:
-                meetings_done = filtered_df['Meeting Done Date'].notna().sum()
-                deals_won = len(won_deals_pic)
-                total_revenue_pic = won_deals_pic['Amount'].sum()
+                if selected_pic in AE_NAMES:
+                    meetings_done = filtered_df['Meeting Done Date'].notna().sum()
+                    deals_won = len(won_deals_pic)
+                    total_revenue_pic = won_deals_pic['Amount'].sum()
                 
-                c1, c2, c3, c4 = st.columns(4)
-                c1.metric("진행 중인 딜", f"{len(open_deals_pic):,} 건")
-                c2.metric("미팅 완료", f"{meetings_done:,} 건")
-                c3.metric("계약 성사 (기간 내)", f"{deals_won:,} 건")
-                c4.metric("총 계약 금액 (기간 내)", f"${total_revenue_pic:,.0f}")
+                    c1, c2, c3, c4 = st.columns(4)
+                    c1.metric("진행 중인 딜", f"{len(open_deals_pic):,} 건")
+                    c2.metric("미팅 완료", f"{meetings_done:,} 건")
+                    c3.metric("계약 성사 (기간 내)", f"{deals_won:,} 건")
+                    c4.metric("총 계약 금액 (기간 내)", f"${total_revenue_pic:,.0f}")
             
-            if selected_pic in BDR_NAMES:
-                initial_contacts = filtered_df[filtered_df['Deal Stage'] == 'Initial Contact'].shape[0]
-                meetings_booked = filtered_df[filtered_df['Deal Stage'] == 'Meeting Booked'].shape[0]
-                conversion_rate = meetings_booked / initial_contacts if initial_contacts > 0 else 0.0
-
-                c1, c2, c3 = st.columns(3)
-                c1.metric("Initial Contacts", f"{initial_contacts:,} 건")
-                c2.metric("Meetings Booked", f"{meetings_booked:,} 건")
-                c3.metric("전환율", f"{conversion_rate:.2%}")
-
-            st.markdown("---")
-            st.subheader("진행 중인 딜 목록")
-            if not open_deals_pic.empty:
-                st.dataframe(open_deals_pic[['Deal name', 'Amount', 'Deal Stage', 'Effective Close Date']], use_container_width=True)
-            else:
-                st.info("현재 진행 중인 딜이 없습니다.")
+                if selected_pic in BDR_NAMES:
+                    stage_counts = filtered_df['Deal Stage'].value_counts()
+                    initial_contacts = int(stage_counts.get('Initial Contact', 0))
+                    meetings_booked = int(stage_counts.get('Meeting Booked', 0))
+                    conversion_rate = meetings_booked / initial_contacts if initial_contacts > 0 else 0.0
+
+                    c1, c2, c3 = st.columns(3)
+                    c1.metric("Initial Contacts", f"{initial_contacts:,} 건")
+                    c2.metric("Meetings Booked", f"{meetings_booked:,} 건")
+                    c3.metric("전환율", f"{conversion_rate:.2%}")
+
+                st.markdown("---")
+                st.subheader("진행 중인 딜 목록")
+                if not open_deals_pic.empty:
+                    # base_df는 필터 기준 날짜 순으로 정렬되어 있으므로 표시는 원래 딜 순서(인덱스)로 되돌림
+                    st.dataframe(open_deals_pic[['Deal name', 'Amount', 'Deal Stage', 'Effective Close Date']].sort_index(), use_container_width=True)
+                else:
+                    st.info("현재 진행 중인 딜이 없습니다.")
             
-            st.subheader("기간 내 성사시킨 딜 목록")
-            if not won_deals_pic.empty:
-                st.dataframe(won_deals_pic[['Deal name', 'Amount', 'Contract Signed Date', 'Payment Complete Date']], use_container_width=True)
-            else:
-                st.info("선택된 기간에 성사시킨 딜이 없습니다.")
+                st.subheader("기간 내 성사시킨 딜 목록")
+                if not won_deals_pic.empty:
+                    st.dataframe(won_deals_pic[['Deal name', 'Amount', 'Contract Signed Date', 'Payment Complete Date']], use_container_width=True)
+                else:
+                    st.info("선택된 기간에 성사시킨 딜이 없습니다.")
 
 with tab3:
-    st.header("주요 딜 관리 및 리스크 분석")
-    st.subheader("🎯 Next Focus (마감 임박 딜)")
-    focus_days = st.selectbox("집중할 기간(일)을 선택하세요:", (30, 60, 90), index=0)
-    today = datetime.now(korea_tz)
-    days_later = today + timedelta(days=focus_days)
-    all_open_deals = df[~df['Deal Stage'].isin(won_stages + lost_stages)]
-    focus_deals = all_open_deals[
-        (all_open_deals.get('Effective Close Date').notna()) &
-        (all_open_deals.get('Effective Close Date') >= today) &
-        (all_open_deals.get('Effective Close Date') <= days_later)
-    ].sort_values('Amount', ascending=False)
-    if not focus_deals.empty:
-        focus_deals['Days to Close'] = (focus_deals['Effective Close Date'] - today).dt.days
-        st.dataframe(focus_deals[['Deal name', 'Deal owner', 'Amount', 'Effective Close Date', 'Days to Close']].style.format({'Amount': '${:,.0f}'}), use_container_width=True)
-    else:
-        st.info(f"향후 {focus_days}일 내에 마감될 것으로 예상되는 딜이 없습니다.")
+    if tab3.open:
+        st.header("주요 딜 관리 및 리스크 분석")
+        st.subheader("🎯 Next Focus (마감 임박 딜)")
+        focus_deals_panel(df, data_version, today)
 
-    st.markdown("---")
-    st.subheader("👀 장기 체류 딜 (Stale Deals) 관리")
-    open_deals_base = base_df[~base_df['Deal Stage'].isin(won_stages + lost_stages)]
-    stale_threshold = st.slider("며칠 이상 같은 단계에 머물면 '장기 체류'로 볼까요?", 7, 90, 30)
-    
-    if 'Date Entered Stage' in open_deals_base.columns:
-        open_deals_stale = open_deals_base.copy().dropna(subset=['Date Entered Stage'])
-        if pd.api.types.is_datetime64_any_dtype(open_deals_stale['Date Entered Stage']):
-            open_deals_stale['Days in Stage'] = (today - open_deals_stale['Date Entered Stage']).dt.days
-            stale_deals_df = open_deals_stale[open_deals_stale['Days in Stage'] > stale_threshold]
-            if not stale_deals_df.empty:
-                st.warning(f"{stale_threshold}일 이상 같은 단계에 머물러 있는 '주의'가 필요한 딜 목록입니다.")
-                st.dataframe(stale_deals_df[['Deal name', 'Deal owner', 'Deal Stage', 'Amount', 'Days in Stage']].sort_values('Days in Stage', ascending=False).style.format({'Amount': '${:,.0f}', 'Days in Stage': '{:.0f}일'}), use_container_width=True)
-            else:
-                st.success("선택된 조건에 해당하는 장기 체류 딜이 없습니다. 👍")
-        else:
-            st.error("'Date Entered Stage' 컬럼이 날짜 형식이 아니어서 '장기 체류 딜'을 계산할 수 없습니다.")
-    else:
-        st.warning("'장기 체류 딜' 분석을 위해서는 HubSpot에서 'hs_v2_date_entered_current_stage' 속성을 포함하여 가져와야 합니다.")
+        st.markdown("---")
+        st.subheader("👀 장기 체류 딜 (Stale Deals) 관리")
+        stale_deals_panel(base_df[base_df['_is_open']], today)
 
 with tab4:
-    st.header("실패 및 드랍 딜 회고")
-    lost_dropped_deals = df[df['Deal Stage'].isin(lost_stages)]
-    if not lost_dropped_deals.empty:
-        sorted_deals = lost_dropped_deals.sort_values(by='Last Modified Date', ascending=False)
-        display_cols = ['Deal name', 'Deal owner', 'Amount', 'Deal Stage', 'Last Modified Date', 'Failure Reason', 'Dropped Reason', 'Dropped Reason (Remark)']
-        existing_display_cols = [col for col in display_cols if col in sorted_deals.columns]
-        st.dataframe(sorted_deals[existing_display_cols].style.format({'Amount': '${:,.0f}'}), use_container_width=True)
-    else:
-        st.info("'Closed Lost', 'Dropped', 'Lost', 'Cancel' 상태의 딜이 없습니다.")
+    if tab4.open:
+        st.header("실패 및 드랍 딜 회고")
+        lost_dropped_deals, lost_total = lost_deals_by_modified(df, data_version)
+        if not lost_dropped_deals.empty:
+            row_limit_caption(lost_total, "최근 수정된")
+            st.dataframe(lost_dropped_deals.style.format({'Amount': '${:,.0f}'}), use_container_width=True)
+        else:
+            st.info("'Closed Lost', 'Dropped', 'Lost', 'Cancel' 상태의 딜이 없습니다.")